@@ -1,16 +1,28 @@
+import functools
 import itertools
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from collections import Counter
-from typing import List, Tuple
+import logging
+import math
+import numpy as np
+from typing import TYPE_CHECKING, Iterable, List, Optional, Tuple
+
+from plotting import color_map, legend_handles, load_matplotlib
+
+if TYPE_CHECKING:
+    # matplotlib is only imported once something is drawn, see load_matplotlib
+    from matplotlib.figure import Figure
+
+logger = logging.getLogger(__name__)
+
+# Nodes the assignment search may visit before it settles for the best layout found so far
+SEARCH_NODE_LIMIT = 20000
 
 # Constants for the two main containers
 def check_total_area(container_lengths: List[int], container_width: int, main_containers: List[dict]) -> bool:
     """
     Checks if the total area of incoming containers fits within the combined area of main containers.
     """
-    total_container_area = sum([length * container_width for length in container_lengths])
-    total_main_area = sum([mc["max_length"] * container_width for mc in main_containers])
+    total_container_area = container_width * sum(container_lengths)
+    total_main_area = container_width * sum(mc["max_length"] for mc in main_containers)
     return total_container_area <= total_main_area
 
 def pair_containers(container_lengths: List[int]) -> Tuple[List[Tuple[int, int]], List[int]]:
@@ -25,27 +37,194 @@ def pair_containers(container_lengths: List[int]) -> Tuple[List[Tuple[int, int]]
             - List of paired container indices as tuples.
             - List of remaining unpaired container indices.
     """
-    length_count = Counter(container_lengths)
+    paired_containers, remaining_containers = _pair_containers_cached(tuple(container_lengths))
+    return list(paired_containers), list(remaining_containers)
+
+def pair_length_counts(length_counts: Iterable[Tuple[int, int]]) -> Tuple[List[Tuple[int, int]], List[int]]:
+    """
+    Pairs containers given as (length, count) groups, without expanding them first.
+
+    Containers are numbered in ascending length order, so the result matches
+    pair_containers on the sorted container lengths.
+
+    Args:
+        length_counts (Iterable[Tuple[int, int]]): (length, count) groups; a length may appear more than once.
+
+    Returns:
+        Tuple containing:
+            - List of paired container indices as tuples.
+            - List of remaining unpaired container indices.
+    """
+    counts = {}
+    for length, count in length_counts:
+        counts[length] = counts.get(length, 0) + count
+
     paired_containers = []
     remaining_containers = []
-    length_to_indices = {}
+    start = 0
+    for length in sorted(counts):
+        count = counts[length]
+        # Each group pairs up its consecutive indices; an odd group leaves its last one
+        paired_containers.extend((idx, idx + 1) for idx in range(start, start + count - 1, 2))
+        if count % 2:
+            remaining_containers.append(start + count - 1)
+        start += count
 
-    # Map each length to its list of original indices
-    for idx, length in enumerate(container_lengths):
-        if length not in length_to_indices:
-            length_to_indices[length] = []
-        length_to_indices[length].append(idx)
+    return paired_containers, remaining_containers
 
-    # Pair containers by length
-    for length, indices in length_to_indices.items():
-        while len(indices) >= 2:
-            paired_containers.append((indices.pop(0), indices.pop(0)))
-        if indices:
-            remaining_containers.append(indices.pop(0))
+@functools.lru_cache(maxsize=128)
+def _pair_containers_cached(
+    container_lengths: Tuple[int, ...]
+) -> Tuple[Tuple[Tuple[int, int], ...], Tuple[int, ...]]:
+    """
+    Memoized implementation of pair_containers. Returns tuples so cached results
+    cannot be mutated by callers.
+    """
+    paired_containers = []
+    remaining_containers = []
 
-    return paired_containers, remaining_containers
+    # Sort indices once by length so equal lengths form adjacent runs
+    order = sorted(range(len(container_lengths)), key=container_lengths.__getitem__)
+
+    # Walk the sorted indices once, pairing neighbours of equal length; an odd run
+    # leaves its last index unpaired
+    i = 0
+    while i < len(order):
+        if i + 1 < len(order) and container_lengths[order[i]] == container_lengths[order[i + 1]]:
+            paired_containers.append((order[i], order[i + 1]))
+            i += 2
+        else:
+            remaining_containers.append(order[i])
+            i += 1
+
+    return tuple(paired_containers), tuple(remaining_containers)
+
+def _fill_level(heights: List[int], max_lengths: Tuple[int, ...], amount: int) -> Optional[int]:
+    """
+    Lowest level the columns must be filled to, each within its max length, to hold
+    the given amount, or None if they cannot hold it at all.
+    """
+    # Sweep the column bottoms and tops: between two of them the space below the
+    # level grows by the number of columns that are open there
+    events = sorted([(height, 1) for height in heights] + [(max_length, -1) for max_length in max_lengths])
+    filled = 0
+    open_columns = 0
+    previous = events[0][0]
+    for position, change in events:
+        if open_columns and filled + open_columns * (position - previous) >= amount:
+            return previous + -(-(amount - filled) // open_columns)
+        filled += open_columns * (position - previous)
+        open_columns += change
+        previous = position
+    return previous if filled >= amount else None
+
+def _search_assignment(
+    paired_containers: Tuple[Tuple[int, int], ...],
+    remaining_containers: Tuple[int, ...],
+    lengths: Tuple[int, ...],
+    column_heights: List[int],
+    max_lengths: Tuple[int, ...]
+) -> Optional[Tuple[List[Tuple[int, int]], List[int], int]]:
+    """
+    Depth-first search placing each pair in two different columns and each remaining
+    container in one column, longest first, keeping the lowest max height.
+
+    Pairs and remaining containers are searched together, so the result only depends
+    on the lengths, not on the order of the pairs. The search is exact unless it runs
+    out of SEARCH_NODE_LIMIT nodes, in which case the best layout found so far is kept;
+    its first descent places every item in the lowest columns where it fits.
+
+    Returns:
+        Tuple of the assignments, the resulting column heights and the max height, or
+        None if no layout was found.
+    """
+    num_columns = len(max_lengths)
+    items = sorted(
+        [(lengths[pair[0]], tuple(pair)) for pair in paired_containers]
+        + [(lengths[idx], (idx,)) for idx in remaining_containers],
+        key=lambda item: (-item[0], len(item[1]))
+    )
+    column_choices = {
+        1: [(col,) for col in range(num_columns)],
+        2: list(itertools.combinations(range(num_columns), 2)),
+    }
+    # Columns of equal capacity are interchangeable, so states that only differ by
+    # swapping their heights are searched once
+    capacity_groups = {}
+    for col, max_length in enumerate(max_lengths):
+        capacity_groups.setdefault(max_length, []).append(col)
+    capacity_groups = list(capacity_groups.values())
+
+    # Length still to be placed from each item on
+    suffix = [0] * (len(items) + 1)
+    for i in range(len(items) - 1, -1, -1):
+        suffix[i] = suffix[i + 1] + items[i][0] * len(items[i][1])
+    # Every column height is a multiple of step, and so is the max height
+    step = math.gcd(*column_heights, *(length for length, _ in items)) or 1
+
+    def _bound(current_max: int, amount: int) -> Optional[int]:
+        level = _fill_level(heights, max_lengths, amount)
+        if level is None:
+            return None
+        return -(-max(level, current_max) // step) * step
+
+    heights = list(column_heights)
+    lower_bound = _bound(max(heights), suffix[0])
+    if lower_bound is None:
+        return None
+
+    best_max = float('inf')
+    best = None
+    chosen = [None] * len(items)
+    visited = set()
+    nodes = 0
+
+    def _search(i: int, current_max: int):
+        nonlocal best_max, best, nodes
+        if i == len(items):
+            best_max = current_max
+            best = (chosen.copy(), heights.copy())
+            return
+
+        bound = _bound(current_max, suffix[i])
+        if bound is None or bound >= best_max:
+            return
+        state = (i, tuple(tuple(sorted(heights[col] for col in group)) for group in capacity_groups))
+        if state in visited:
+            return
+        visited.add(state)
+        nodes += 1
+
+        length, containers = items[i]
+        for cols in sorted(column_choices[len(containers)], key=lambda cols: sum(heights[col] for col in cols)):
+            if any(heights[col] + length > max_lengths[col] for col in cols):
+                continue
+            new_max = max(current_max, max(heights[col] for col in cols) + length)
+            if new_max >= best_max:
+                continue
+            for col in cols:
+                heights[col] += length
+            chosen[i] = cols
+            _search(i + 1, new_max)
+            for col in cols:
+                heights[col] -= length
+            if best_max <= lower_bound or nodes >= SEARCH_NODE_LIMIT:
+                return
+
+    _search(0, max(heights))
+
+    if best is None:
+        return None
+    best_cols, best_heights = best
+    assignments = [
+        (idx, col)
+        for (_, containers), cols in zip(items, best_cols)
+        for idx, col in zip(containers, cols)
+    ]
+    return assignments, best_heights, best_max
 
 def find_optimal_assignment(
+
     paired_containers: List[Tuple[int, int]], 
     remaining_containers: List[int], 
     container_lengths: List[int], 
@@ -64,70 +243,42 @@ def find_optimal_assignment(
         Tuple[List[Tuple[int, int]], List[int], float]: 
             Assignments, column heights, and optimal max height.
     """
-    num_columns = len(columns)
-    column_heights = [col["current_length"] for col in columns]
-    assignments = []  # List of tuples (container_idx, column_idx)
-
-    # Assign paired containers first
-    for pair in paired_containers:
-        # Try to assign each container in the pair to different columns
-        assigned = False
-        for col1, col2 in itertools.combinations(range(num_columns), 2):
-            len1 = container_lengths[pair[0]]
-            len2 = container_lengths[pair[1]]
-            if (column_heights[col1] + len1 <= columns[col1]["max_length"] and
-                column_heights[col2] + len2 <= columns[col2]["max_length"]):
-                assignments.append((pair[0], col1))
-                assignments.append((pair[1], col2))
-                column_heights[col1] += len1
-                column_heights[col2] += len2
-                assigned = True
-                break
-        if not assigned:
-            print(f"Cannot assign paired containers {pair} without exceeding capacities.")
-            return None, None, None
-
-    print(f"Paired assignments after pairing step: {assignments}")
-    print(f"Column heights after pairing: {column_heights}")
-
-    # Assign remaining containers
-    optimal_max_height = float('inf')
-    optimal_assignment = None
-
-    # Generate all possible assignments for remaining containers
-    for assignment in itertools.product(range(num_columns), repeat=len(remaining_containers)):
-        temp_heights = column_heights.copy()
-        valid = True
-
-        for idx, col in zip(remaining_containers, assignment):
-            length = container_lengths[idx]
-            temp_heights[col] += length
-            if temp_heights[col] > columns[col]["max_length"]:
-                valid = False
-                break
-
-        if valid:
-            current_max = max(temp_heights)
-            if current_max < optimal_max_height:
-                optimal_max_height = current_max
-                optimal_assignment = assignment
-
-    print(f"Optimal assignment for remaining containers: {optimal_assignment}")
-    print(f"Optimal max height: {optimal_max_height}")
-
-    # Apply the optimal assignment to remaining containers
-    if optimal_assignment is not None:
-        for idx, col in zip(remaining_containers, optimal_assignment):
-            assignments.append((idx, col))
-            column_heights[col] += container_lengths[idx]
-    else:
-        print("No valid assignment found for remaining containers.")
+    # Only the capacities and starting heights of the columns affect the result
+    column_specs = tuple((col["max_length"], col["current_length"]) for col in columns)
+    assignments, column_heights, optimal_max_height = _find_optimal_assignment_cached(
+        tuple(map(tuple, paired_containers)),
+        tuple(remaining_containers),
+        tuple(container_lengths),
+        column_specs
+    )
+    if assignments is None:
+        return None, None, None
+    return list(assignments), list(column_heights), optimal_max_height
+
+@functools.lru_cache(maxsize=128)
+def _find_optimal_assignment_cached(
+    paired_containers: Tuple[Tuple[int, int], ...],
+    remaining_containers: Tuple[int, ...],
+    lengths: Tuple[int, ...],
+    column_specs: Tuple[Tuple[int, int], ...]
+):
+    """
+    Memoized implementation of find_optimal_assignment, keyed on hashable inputs.
+    column_specs holds a (max_length, current_length) tuple per column. Returns
+    tuples so cached results cannot be mutated by callers.
+    """
+    max_lengths = tuple(max_length for max_length, _ in column_specs)
+    start_heights = [current_length for _, current_length in column_specs]
+
+    best = _search_assignment(paired_containers, remaining_containers, lengths, start_heights, max_lengths)
+    if best is None:
+        logger.warning("No valid assignment found for the containers.")
         return None, None, None
 
-    print(f"Final assignments after adding remaining containers: {assignments}")
-    print(f"Final column heights: {column_heights}")
+    assignments, column_heights, optimal_max_height = best
+    logger.debug("Final assignments: %s, column heights: %s", assignments, column_heights)
 
-    return assignments, column_heights, optimal_max_height
+    return tuple(assignments), tuple(column_heights), optimal_max_height
 
 
 
@@ -137,7 +288,7 @@ def visualize_assignment(
     columns: List[dict], 
     paired_containers: List[Tuple[int, int]], 
     container_width: int
-) -> List[plt.Figure]:
+) -> List["Figure"]:
     """
     Visualizes the container assignments to the columns within main containers.
     Ensures that containers with the same length have the same color across all main containers.
@@ -150,8 +301,13 @@ def visualize_assignment(
         container_width (int): Fixed width of incoming containers.
 
     Returns:
-        List[plt.Figure]: List of figures for each main container.
+        List[Figure]: List of figures for each main container.
     """
+    load_matplotlib()
+    import matplotlib.patches as patches
+    from matplotlib.collections import PatchCollection
+    from matplotlib.figure import Figure
+
     # Create a set of all paired container indices for quick lookup
     paired_set = set(itertools.chain.from_iterable(paired_containers))
 
@@ -159,17 +315,23 @@ def visualize_assignment(
     container_a_columns = [0, 1]  # Indices for Container A's columns
     container_b_columns = [2, 3]  # Indices for Container B's columns
 
-    assignments_a = [assignment for assignment in assignments if assignment[1] in container_a_columns]
-    assignments_b = [assignment for assignment in assignments if assignment[1] in container_b_columns]
+    lengths = np.asarray(container_lengths)
 
-    # Extract all unique lengths for color mapping
-    unique_lengths = sorted(set(container_lengths))
-    cmap = plt.get_cmap('tab20', len(unique_lengths))
-    length_color_map = {length: cmap(i) for i, length in enumerate(unique_lengths)}
+    # Group container indices by column once, keeping assignment order
+    containers_by_column = {}
+    for container_idx, col_idx in assignments:
+        containers_by_column.setdefault(col_idx, []).append(container_idx)
 
-    # Function to plot a single main container
-    def plot_main_container(assignments, main_container_columns, main_container_name):
-        fig, ax = plt.subplots(figsize=(8, 6))  # Adjusted figure size for better clarity
+    # Colors and legend entries only depend on the set of lengths
+    unique_lengths = tuple(np.unique(lengths).tolist())
+    length_color_map = color_map(unique_lengths)
+    handles = legend_handles(unique_lengths)
+
+    # Axes, labels and column outlines: everything that does not depend on the assignment
+    def _build_skeleton(main_container_columns, main_container_name):
+        # Build the figure directly, bypassing pyplot's global figure manager
+        fig = Figure(figsize=(8, 6))  # Adjusted figure size for better clarity
+        ax = fig.subplots()
 
         # Determine the maximum length among the columns for setting plot limits
         max_length = max([columns[col]["max_length"] for col in main_container_columns])
@@ -181,63 +343,68 @@ def visualize_assignment(
 
         # Draw the main container boundaries
         for col_idx in main_container_columns:
-            col = columns[col_idx]
             x_offset = (col_idx % 2) * (container_width + 50)  # Adjusted spacing between columns
-            main_rect = patches.Rectangle((x_offset, 0), container_width, col["max_length"],
+            main_rect = patches.Rectangle((x_offset, 0), container_width, columns[col_idx]["max_length"],
                                           linewidth=2, edgecolor='black', facecolor='none')
             ax.add_patch(main_rect)
 
-            # Draw containers within the column
-            current_height = 0
-            for assignment in assignments:
-                container_idx, assigned_col = assignment
-                if assigned_col != col_idx:
-                    continue
-                length = container_lengths[container_idx]
-                color = length_color_map[length]
+        ax.legend(handles=handles, title='Container Lengths', bbox_to_anchor=(1.05, 1), loc='upper left')
+
+        # Set aspect ratio to equal to maintain scaling
+        ax.set_aspect('equal', adjustable='box')
+
+        return fig, ax
+
+    # Stack the assigned containers inside their columns
+    def _draw_containers(ax, main_container_columns):
+        rects = []
+        facecolors = []
+        edgecolors = []
+        linewidths = []
+        for col_idx in main_container_columns:
+            x_offset = (col_idx % 2) * (container_width + 50)
+            column_containers = containers_by_column.get(col_idx, [])
+            # Each container starts where the ones below it end: a prefix sum of their lengths
+            column_lengths = lengths[column_containers]
+            bottoms = np.cumsum(column_lengths) - column_lengths
+            for container_idx, bottom, length in zip(column_containers, bottoms.tolist(), column_lengths.tolist()):
                 is_paired = container_idx in paired_set
-                rect = patches.Rectangle(
-                    (x_offset, current_height),
-                    container_width,
-                    length,
-                    linewidth=1,
-                    edgecolor='blue' if not is_paired else 'red',
-                    facecolor=color,
-                    alpha=0.7
-                )
-                ax.add_patch(rect)
+                rects.append(patches.Rectangle((x_offset, bottom), container_width, length))
+                facecolors.append(length_color_map[length])
+                # Paired containers get a thicker red edge
+                edgecolors.append('red' if is_paired else 'blue')
+                linewidths.append(2 if is_paired else 1)
                 # Annotate the container with its index
                 ax.text(
                     x_offset + container_width / 2,
-                    current_height + length / 2,
+                    bottom + length / 2,
                     str(container_idx + 1),
                     ha='center',
                     va='center',
                     fontsize=8,
                     color='white'
                 )
-                if is_paired:
-                    rect.set_edgecolor('red')
-                    rect.set_linewidth(2)
-                current_height += length
-
-        # Create a legend for container lengths
-        handles = [
-            patches.Patch(color=color, label=f'Length {length} mm')
-            for length, color in length_color_map.items()
-        ]
-        ax.legend(handles=handles, title='Container Lengths', bbox_to_anchor=(1.05, 1), loc='upper left')
 
-        # Set aspect ratio to equal to maintain scaling
-        ax.set_aspect('equal', adjustable='box')
+        # A single collection artist instead of one patch per container
+        ax.add_collection(PatchCollection(
+            rects,
+            facecolors=facecolors,
+            edgecolors=edgecolors,
+            linewidths=linewidths,
+            alpha=0.7
+        ))
 
+    # Function to plot a single main container
+    def plot_main_container(main_container_columns, main_container_name):
+        fig, ax = _build_skeleton(main_container_columns, main_container_name)
+        _draw_containers(ax, main_container_columns)
         return fig
 
     # Plot Container A
-    fig_a = plot_main_container(assignments_a, container_a_columns, "Tandem Truck")
+    fig_a = plot_main_container(container_a_columns, "Tandem Truck")
 
     # Plot Container B
-    fig_b = plot_main_container(assignments_b, container_b_columns, "Tandem Trailer")
+    fig_b = plot_main_container(container_b_columns, "Tandem Trailer")
 
     return [fig_a, fig_b]
 
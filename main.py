@@ -1,19 +1,8 @@
-import streamlit as st
-
-# Import your custom modules
-from sleper import (
-    check_total_area as sleper_check_total_area,
-    pair_containers as sleper_pair_containers,
-    find_optimal_assignment as sleper_find_optimal_assignment,
-    visualize_assignment as sleper_visualize_assignment,
-)
-from kip import (
-    check_total_area as kip_check_total_area,
-    pair_containers as kip_pair_containers,
-    find_optimal_assignment as kip_find_optimal_assignment,
-    visualize_assignment as kip_visualize_assignment,
-)
+import io
+from types import SimpleNamespace
 
+import numpy as np
+import streamlit as st
 
 MAIN_LENGTH = 13300  # Length of the main container
 MAIN_WIDTH = 2400    # Width of the main container
@@ -45,6 +34,47 @@ def remove_pallet():
     else:
         st.warning("At least one pallet input is required.")
 
+# The packing modules are only needed once the form is submitted, so they are
+# imported on first use and kept for the lifetime of the process
+@st.cache_resource(show_spinner=False)
+def _get_packers():
+    from sleper import (
+        check_total_area as sleper_check_total_area,
+        find_optimal_assignment as sleper_find_optimal_assignment,
+        visualize_assignment as sleper_visualize_assignment,
+    )
+    from kip import (
+        check_total_area as kip_check_total_area,
+        pair_length_counts,
+        find_optimal_assignment as kip_find_optimal_assignment,
+        visualize_assignment as kip_visualize_assignment,
+    )
+    return SimpleNamespace(
+        sleper_check_total_area=sleper_check_total_area,
+        sleper_find_optimal_assignment=sleper_find_optimal_assignment,
+        sleper_visualize_assignment=sleper_visualize_assignment,
+        kip_check_total_area=kip_check_total_area,
+        pair_length_counts=pair_length_counts,
+        kip_find_optimal_assignment=kip_find_optimal_assignment,
+        kip_visualize_assignment=kip_visualize_assignment,
+    )
+
+# Results are cached across reruns and sessions; st.cache_data hands out copies,
+# so callers are free to mutate them
+@st.cache_data(max_entries=256, show_spinner=False)
+def pack_main_truck(sorted_lengths, paired_containers, remaining_containers):
+    return _get_packers().sleper_find_optimal_assignment(paired_containers, remaining_containers, sorted_lengths, MAIN_LENGTH)
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def pack_tandem_truck(sorted_lengths, paired_containers, remaining_containers):
+    return _get_packers().kip_find_optimal_assignment(paired_containers, remaining_containers, sorted_lengths, MAIN_CONTAINERS)
+
+def show_figure(fig):
+    # Render to PNG once here rather than letting st.pyplot render the figure again
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight', dpi=90)
+    st.image(buf.getvalue())
+
 def main():
     st.set_page_config(page_title="📦 Container Packing Application", layout="wide")
     st.title("📦 Container Packing Application")
@@ -63,40 +93,46 @@ def main():
 
     st.header("Enter Pallet Details")
 
-    # Display pallet inputs
-    for idx, pallet in enumerate(st.session_state.pallets):
-        with st.expander(f"Pallet {idx + 1}"):
-            col1, col2 = st.columns(2)
-            with col1:
-                length_key = f'pallet_length_{idx}'
-                st.session_state.pallets[idx]['length'] = st.number_input(
-                    f"Pallet {idx + 1} Length (mm)",
-                    min_value=MIN_LENGTH,
-                    max_value=MAX_LENGTH,
-                    value=pallet['length'],
-                    step=1,
-                    key=length_key
-                )
-            with col2:
-                count_key = f'pallet_count_{idx}'
-                st.session_state.pallets[idx]['count'] = st.number_input(
-                    f"Pallet {idx + 1} Count",
-                    min_value=1,
-                    value=pallet['count'],
-                    step=1,
-                    key=count_key
-                )
-
-    st.markdown("---")
-
-    if st.button("Execute Packaging"):
+    # Display pallet inputs inside a form, so edits are sent in one rerun on submit
+    # instead of rerunning the script for every changed input
+    with st.form("pallets_form"):
+        for idx, pallet in enumerate(st.session_state.pallets):
+            with st.expander(f"Pallet {idx + 1}"):
+                col1, col2 = st.columns(2)
+                with col1:
+                    length_key = f'pallet_length_{idx}'
+                    st.session_state.pallets[idx]['length'] = st.number_input(
+                        f"Pallet {idx + 1} Length (mm)",
+                        min_value=MIN_LENGTH,
+                        max_value=MAX_LENGTH,
+                        value=pallet['length'],
+                        step=1,
+                        key=length_key
+                    )
+                with col2:
+                    count_key = f'pallet_count_{idx}'
+                    st.session_state.pallets[idx]['count'] = st.number_input(
+                        f"Pallet {idx + 1} Count",
+                        min_value=1,
+                        value=pallet['count'],
+                        step=1,
+                        key=count_key
+                    )
+
+        st.markdown("---")
+
+        submitted = st.form_submit_button("Execute Packaging")
+
+    if submitted:
         execute_packing()
 
 def execute_packing():
     st.markdown("### Execution Status")
+    packers = _get_packers()
     try:
         # Extract container lengths based on pallets
-        container_lengths = []
+        pallet_lengths = []
+        pallet_counts = []
         for idx, pallet in enumerate(st.session_state.pallets, start=1):
             length = pallet['length']
             count = pallet['count']
@@ -104,28 +140,44 @@ def execute_packing():
                 raise ValueError(f"Pallet {idx} length {length} mm is out of allowed range ({MIN_LENGTH}-{MAX_LENGTH} mm).")
             if count < 1:
                 raise ValueError(f"Pallet {idx} count must be at least 1.")
-            # Repeat the length based on count
-            container_lengths.extend([length] * count)
+            pallet_lengths.append(length)
+            pallet_counts.append(count)
+        # One entry per container, each pallet's length repeated by its count
+        container_lengths = np.repeat(pallet_lengths, pallet_counts)
+
+        # Neither truck's search depends on the order of the containers, only on the multiset
+        # of lengths: solve for the sorted lengths so any ordering of the same pallets hits
+        # the cache, then map indices back via `order`.
+        order = np.argsort(container_lengths, kind='stable').tolist()
+        sorted_lengths = tuple(container_lengths[order].tolist())
+
+        # Pairing only depends on the lengths, so both packing attempts share it, and it can
+        # be read off the (length, count) groups directly
+        paired_containers, remaining_containers = packers.pair_length_counts(zip(pallet_lengths, pallet_counts))
+        # The same pairs, as indices into container_lengths, are highlighted in both plots
+        input_pairs = [(order[first], order[second]) for first, second in paired_containers]
 
         # First attempt: Try using sleper.py logic
         st.info("Attempting packing using the main truck...")
-        if sleper_check_total_area(container_lengths, CONTAINER_WIDTH, MAIN_LENGTH, MAIN_WIDTH):
-            paired_containers, remaining_containers = sleper_pair_containers(container_lengths)
+        if packers.sleper_check_total_area(sorted_lengths, CONTAINER_WIDTH, MAIN_LENGTH, MAIN_WIDTH):
             try:
-                assignments, column_heights, optimal_max_height = sleper_find_optimal_assignment(
-                    paired_containers, remaining_containers, container_lengths, MAIN_LENGTH
+                assignments, column_heights, optimal_max_height = pack_main_truck(
+                    sorted_lengths, paired_containers, remaining_containers
                 )
+                assignments = [(order[idx], col) for idx, col in assignments]
                 st.success("Packing successful using the main truck.")
                 st.write(f"Space taken in first row: {column_heights[0]}")
                 st.write(f"Space taken in second row: {column_heights[1]}")
 
                 # Visualize the assignment
-                figures = sleper_visualize_assignment(container_lengths, assignments, MAIN_LENGTH, MAIN_WIDTH, CONTAINER_WIDTH)
+                figures = packers.sleper_visualize_assignment(
+                    container_lengths, assignments, MAIN_LENGTH, MAIN_WIDTH, CONTAINER_WIDTH, input_pairs
+                )
                 if figures:
                     for fig in figures:
                         # Ensure that both axes are scaled correctly
                         fig.axes[0].set_aspect('equal', adjustable='box')
-                        st.pyplot(fig)
+                        show_figure(fig)
                 else:
                     st.warning("Visualization function did not return any figures for sleper.py logic.")
                 return
@@ -136,23 +188,23 @@ def execute_packing():
 
         # Second attempt: Use kip.py logic
         st.info("Attempting packing using tandem truck")
-        if kip_check_total_area(container_lengths, CONTAINER_WIDTH, MAIN_CONTAINERS):
-            paired_containers, remaining_containers = kip_pair_containers(container_lengths)
-            optimal_assignment, column_heights, optimal_max_height = kip_find_optimal_assignment(
-                paired_containers, remaining_containers, container_lengths, MAIN_CONTAINERS
+        if packers.kip_check_total_area(sorted_lengths, CONTAINER_WIDTH, MAIN_CONTAINERS):
+            optimal_assignment, column_heights, optimal_max_height = pack_tandem_truck(
+                sorted_lengths, paired_containers, remaining_containers
             )
             if optimal_assignment is not None:
                 st.success("Packing successful using tandem truck.")
+                optimal_assignment = [(order[idx], col) for idx, col in optimal_assignment]
 
                 # Visualize the assignment
-                figures = kip_visualize_assignment(container_lengths, optimal_assignment, MAIN_CONTAINERS, paired_containers, CONTAINER_WIDTH)
+                figures = packers.kip_visualize_assignment(container_lengths, optimal_assignment, MAIN_CONTAINERS, input_pairs, CONTAINER_WIDTH)
                 if figures:
                     for fig in figures:
                         # Ensure that both axes are scaled correctly
                         fig.text(0.65, 0.6, f"right side = {column_heights.pop(0)} mm")
                         fig.text(0.65, 0.5, f"left side = {column_heights.pop(0)} mm")
                         fig.axes[0].set_aspect('equal', adjustable='box')
-                        st.pyplot(fig)
+                        show_figure(fig)
                 else:
                     st.warning("Visualization function did not return any figures for tandem truck.")
             else:
@@ -0,0 +1,43 @@
+import functools
+from typing import TYPE_CHECKING, Tuple
+
+if TYPE_CHECKING:
+    # matplotlib is only imported once something is drawn, see load_matplotlib
+    import matplotlib.patches as patches
+
+@functools.lru_cache(maxsize=None)
+def load_matplotlib():
+    """
+    Imports matplotlib on first use, so packing alone never pays for it.
+    """
+    import matplotlib
+    matplotlib.use("Agg")  # Figures are only rendered to images, never shown interactively
+    return matplotlib
+
+@functools.lru_cache(maxsize=32)
+def color_map(unique_lengths: Tuple[int, ...]) -> dict:
+    """
+    Maps each length to a color, so containers of the same length share a color.
+
+    Args:
+        unique_lengths (Tuple[int, ...]): Sorted unique container lengths.
+
+    Returns:
+        dict: Length to RGBA color mapping.
+    """
+    cmap = load_matplotlib().colormaps['tab20'].resampled(len(unique_lengths))
+    return {length: cmap(i) for i, length in enumerate(unique_lengths)}
+
+@functools.lru_cache(maxsize=32)
+def legend_handles(unique_lengths: Tuple[int, ...]) -> Tuple["patches.Patch", ...]:
+    """
+    Builds the legend handles for a set of lengths, colored as in color_map. Returns
+    a tuple so cached results cannot be mutated by callers.
+    """
+    load_matplotlib()
+    import matplotlib.patches as patches
+
+    return tuple(
+        patches.Patch(color=color, label=f'Length {length} mm')
+        for length, color in color_map(unique_lengths).items()
+    )
@@ -1,43 +1,23 @@
 import itertools
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from collections import Counter
-from typing import List, Tuple
-from itertools import permutations
-from collections import defaultdict
+import logging
+import numpy as np
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+# Pairing does not depend on the truck layout, so it is shared with the tandem truck
+from kip import pair_containers
+from plotting import color_map, legend_handles, load_matplotlib
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
+logger = logging.getLogger(__name__)
 
 
 def check_total_area(container_lengths: List[int], container_width: int, main_length: int, main_width: int) -> bool:
     """
     Check if the total surface area of containers exceeds the main container's area.
     """
-    total_container_area = sum([length * container_width for length in container_lengths])
-    main_container_area = main_length * main_width
-    return total_container_area <= main_container_area
-
-def pair_containers(container_lengths: List[int]) -> Tuple[List[Tuple[int, int]], List[int]]:
-    """
-    Groups containers with the same length into pairs and keeps remaining unpaired containers.
-    """
-    length_count = Counter(container_lengths)
-    paired_containers = []
-    remaining_containers = []
-    length_to_indices = {}
-
-    # Prepare a mapping of lengths to indices
-    for idx, length in enumerate(container_lengths):
-        if length not in length_to_indices:
-            length_to_indices[length] = []
-        length_to_indices[length].append(idx)
-
-    # Pair containers by length
-    for length, indices in length_to_indices.items():
-        while len(indices) >= 2:
-            paired_containers.append((indices.pop(0), indices.pop(0)))
-        if indices:
-            remaining_containers.append(indices.pop(0))
-
-    return paired_containers, remaining_containers
+    return container_width * sum(container_lengths) <= main_length * main_width
 
 def find_optimal_assignment(
     paired_containers: List[Tuple[int, int]], 
@@ -48,7 +28,7 @@ def find_optimal_assignment(
 ) -> Tuple[List[Tuple[int, int]], List[int], int]:
     """
     Assign containers to columns, prioritizing paired containers first.
-    If pairing fails, try all permutations of all containers without pairing.
+    If pairing fails, search assignments of all containers without pairing.
     """
     assignments = []
     column_heights = [0] * num_columns
@@ -70,79 +50,211 @@ def find_optimal_assignment(
         return assignments, column_heights, optimal_max_height
 
     except ValueError:
-        # If assignment with pairing fails, try all permutations of all containers
-        print("Pairing failed, trying all permutations of all containers...")
         all_containers = list(range(len(container_lengths)))
-        optimal_max_height = float('inf')
-        optimal_assignment = None
-
-        for perm in permutations(all_containers):
-            temp_heights = [0] * num_columns
-            valid = True
-            temp_assignments = []
-
-            for idx in perm:
-                # Try to assign to the column with the least height
-                col = min(range(num_columns), key=lambda c: temp_heights[c])
-                temp_heights[col] += container_lengths[idx]
-                if temp_heights[col] > max_length:
-                    valid = False
-                    break
-                temp_assignments.append((idx, col))
-
-            if valid:
-                current_max = max(temp_heights)
-                if current_max < optimal_max_height:
-                    optimal_max_height = current_max
-                    optimal_assignment = temp_assignments
+        if num_columns == 2:
+            # With two columns the best split is a subset-sum problem, so there is
+            # no need to enumerate container orderings
+            logger.info("Pairing failed, splitting all containers between the two columns...")
+            optimal_assignment, column_heights, optimal_max_height = partition_two_columns(all_containers, container_lengths, max_length)
+        else:
+            logger.info("Pairing failed, searching assignments of all containers...")
+            optimal_assignment, column_heights, optimal_max_height = search_all_assignments(
+                all_containers, container_lengths, max_length, num_columns
+            )
 
         if optimal_assignment is not None:
-            column_heights = [sum(container_lengths[idx] for idx, col in optimal_assignment if col == c) for c in range(num_columns)]
             return optimal_assignment, column_heights, optimal_max_height
         else:
-            raise ValueError("No valid assignment found for all containers even with permutations.")
+            raise ValueError("No valid assignment found for all containers without pairing.")
+
+def search_all_assignments(
+    containers: List[int],
+    container_lengths: List[int],
+    max_length: int,
+    num_columns: int,
+    column_heights: Optional[List[int]] = None
+) -> Tuple[Optional[List[Tuple[int, int]]], Optional[List[int]], float]:
+    """
+    Branch-and-bound over column assignments: places containers longest first, tries the
+    lowest columns first and drops any branch that cannot beat the best max height found so far.
+    Columns start empty unless column_heights is given.
+    Gives the same optimal max height as trying every permutation of the containers.
+    Returns the assignments, the column heights and the max height, or None, None, inf if nothing fits.
+    """
+    heights = list(column_heights) if column_heights is not None else [0] * num_columns
+    start_max = max(heights)
+    if start_max > max_length:
+        return None, None, float('inf')
+
+    order = sorted(containers, key=lambda idx: -container_lengths[idx])
+    lengths = [container_lengths[idx] for idx in order]
+    n = len(order)
+    if n == 0:
+        return [], heights, start_max
+
+    # No assignment can do better than an even split, the longest container on the
+    # lowest column, or the tallest column so far
+    total = sum(lengths) + sum(heights)
+    lower_bound = max(lengths[0] + min(heights), -(-total // num_columns), start_max)
+    # Columns that start at the same height are interchangeable
+    same_start = start_max == min(heights)
+
+    chosen = [0] * n
+    best_max = float('inf')
+    best_columns = None
+    best_heights = None
+
+    def _dfs(i: int, current_max: int):
+        nonlocal best_max, best_columns, best_heights
+        if i == n:
+            best_max = current_max
+            best_columns = chosen.copy()
+            best_heights = heights.copy()
+            return
+
+        length = lengths[i]
+        # With interchangeable columns the first container always goes to column 0, and
+        # equal-length containers only go to non-decreasing columns
+        if i == 0 and same_start:
+            candidates = (0,)
+        else:
+            first_col = chosen[i - 1] if i and length == lengths[i - 1] else 0
+            candidates = sorted(range(first_col, num_columns), key=heights.__getitem__)
+
+        for col in candidates:
+            height = heights[col] + length
+            # The max height only changes through the column just raised, so compare
+            # against it directly instead of rescanning every column
+            new_max = height if height > current_max else current_max
+            if height > max_length or new_max >= best_max:
+                continue
+            heights[col] = height
+            chosen[i] = col
+            _dfs(i + 1, new_max)
+            heights[col] = height - length
+            if best_max <= lower_bound:
+                return
+
+    _dfs(0, start_max)
+    if best_columns is None:
+        return None, None, float('inf')
+    return [(idx, col) for idx, col in zip(order, best_columns)], best_heights, best_max
+
+def best_split(total: int, reachable: int, height0: int, height1: int, max_length: int) -> Optional[int]:
+    """
+    Splits items of the given total length between two columns of equal capacity.
+
+    Args:
+        total (int): Total length of the items.
+        reachable (int): Bitset of the reachable subset sums of the items.
+        height0 (int): Starting height of the first column.
+        height1 (int): Starting height of the second column.
+        max_length (int): Max length of both columns.
+
+    Returns:
+        Optional[int]: Length to put in the first column that minimizes the taller
+            column, or None if the items cannot be split within capacity.
+    """
+    low = max(0, total - (max_length - height1))
+    high = max_length - height0
+    if low > high:
+        return None
+    # Ideal length for the first column, clamped to the feasible range
+    target = min(max((total + height1 - height0) // 2, low), high)
+
+    best = None
+    below = reachable & ((1 << (target + 1)) - 1)
+    if below and below.bit_length() - 1 >= low:
+        best = below.bit_length() - 1
+    above = reachable >> target
+    if above:
+        candidate = target + (above & -above).bit_length() - 1
+        if candidate <= high and (
+            best is None
+            or max(height0 + candidate, height1 + total - candidate) < max(height0 + best, height1 + total - best)
+        ):
+            best = candidate
+    return best
+
+def partition_two_columns(
+    containers: List[int],
+    container_lengths: List[int],
+    max_length: int,
+    column_heights: Tuple[int, int] = (0, 0)
+) -> Tuple[Optional[List[Tuple[int, int]]], Optional[List[int]], float]:
+    """
+    Split containers between two columns, already filled to column_heights, so the taller
+    column is as low as possible.
+    Uses a subset-sum DP where the reachable heights added to the first column are bits of a Python int.
+    Returns the assignments, the final column heights and the max height, or None, None, inf if nothing fits.
+    """
+    height0, height1 = column_heights
+
+    # reachable[i] holds the first-column heights reachable with containers[:i]
+    height_mask = (1 << (max_length + 1)) - 1
+    reachable = [1]
+    for idx in containers:
+        reachable.append((reachable[-1] | (reachable[-1] << container_lengths[idx])) & height_mask)
+
+    total = sum(container_lengths[idx] for idx in containers)
+    split = best_split(total, reachable[-1], height0, height1, max_length)
+    if split is None:
+        return None, None, float('inf')
+    final_heights = [height0 + split, height1 + total - split]
+    optimal_max_height = max(final_heights)
+
+    # Walk back through the containers, keeping each one out of the first column
+    # whenever the remaining height is reachable without it
+    assignments = []
+    for pos in range(len(containers) - 1, -1, -1):
+        idx = containers[pos]
+        if reachable[pos] >> split & 1:
+            assignments.append((idx, 1))
+        else:
+            assignments.append((idx, 0))
+            split -= container_lengths[idx]
+    assignments.reverse()
+
+    return assignments, final_heights, optimal_max_height
 
 def assign_paired_containers(paired_containers: List[Tuple[int, int]], container_lengths: List[int], num_columns: int) -> Tuple[List[Tuple[int, int]], List[int]]:
     """
     Assign paired containers to columns in an alternating fashion.
     """
-    column_heights = [0] * num_columns
-    assignments = []
+    # The two containers of a pair always land in the first two columns
+    columns = (0, 1 % num_columns)
+    assignments = [(pair[i], columns[i]) for pair in paired_containers for i in (0, 1)]
 
-    for pair in paired_containers:
-        for i, idx in enumerate(pair):
-            col = i % num_columns  # Alternate between columns for pairing
-            assignments.append((idx, col))
-            column_heights[col] += container_lengths[idx]
+    # Pairs are made of equal lengths, so each one adds the same height to both columns
+    pair_height = sum(container_lengths[first] for first, _ in paired_containers)
+    column_heights = [0] * num_columns
+    column_heights[columns[0]] += pair_height
+    column_heights[columns[1]] += pair_height
 
     return assignments, column_heights
 
 def assign_remaining_containers(remaining_containers: List[int], container_lengths: List[int], column_heights: List[int], max_length: int, num_columns: int) -> Tuple[List[Tuple[int, int]], List[int]]:
     """
-    Assign remaining unpaired containers to columns using a brute-force approach to find the optimal assignment.
+    Assign remaining unpaired containers to columns, finding the optimal assignment with a
+    subset-sum split for two columns and a branch-and-bound search otherwise.
     """
     if not remaining_containers:
         return [], column_heights.copy()
 
-    optimal_max_height = float('inf')
     optimal_assignment = None
-
-    # Generate all possible assignments for remaining containers
-    for assignment in itertools.product(range(num_columns), repeat=len(remaining_containers)):
-        temp_heights = column_heights.copy()
-        valid = True
-
-        for idx, col in zip(remaining_containers, assignment):
-            temp_heights[col] += container_lengths[idx]
-            if temp_heights[col] > max_length:
-                valid = False
-                break
-
-        if valid:
-            current_max = max(temp_heights)
-            if current_max < optimal_max_height:
-                optimal_max_height = current_max
-                optimal_assignment = assignment
+    if num_columns == 2:
+        # Two columns only need the best subset for the first one, found by the
+        # subset-sum DP rather than by trying every assignment
+        split_assignments, _, _ = partition_two_columns(remaining_containers, container_lengths, max_length, tuple(column_heights))
+        if split_assignments is not None:
+            optimal_assignment = [col for _, col in split_assignments]
+    else:
+        # The pruned search keeps memory constant, unlike materializing all
+        # num_columns ** k assignments
+        found, _, _ = search_all_assignments(remaining_containers, container_lengths, max_length, num_columns, column_heights)
+        if found is not None:
+            column_of = dict(found)
+            optimal_assignment = [column_of[idx] for idx in remaining_containers]
 
     if optimal_assignment is not None:
         final_assignments = []
@@ -160,37 +272,38 @@ def visualize_assignment(
     assignments: List[Tuple[int, int]],
     main_length: int,
     main_width: int,
-    container_width: int
-) -> List[plt.Figure]:
+    container_width: int,
+    paired_containers: Optional[List[Tuple[int, int]]] = None
+) -> List["Figure"]:
     """
     Visualize the container assignments, ensuring that containers with the same length have the same color.
     """
+    # matplotlib is only needed for drawing, so it is imported here rather than with the module
+    load_matplotlib()
+    import matplotlib.patches as patches
+    from matplotlib.collections import PatchCollection
+    from matplotlib.figure import Figure
+
     num_columns = 2
+    lengths = np.asarray(container_lengths)
     columns = [[] for _ in range(num_columns)]
-    column_heights = [0] * num_columns
 
     # Organize containers into columns based on assignments
     for idx, col in assignments:
         columns[col].append(idx)
-        column_heights[col] += container_lengths[idx]
 
-    # Identify paired containers for visualization
-    paired_indices = set()
-    length_to_indices = defaultdict(list)
-    for idx, length in enumerate(container_lengths):
-        length_to_indices[length].append(idx)
+    # Paired containers are highlighted; pair them here only if the caller did not
+    if paired_containers is None:
+        paired_containers, _ = pair_containers(container_lengths)
+    paired_indices = set(itertools.chain.from_iterable(paired_containers))
 
-    for indices in length_to_indices.values():
-        if len(indices) >= 2:
-            paired_indices.update(indices[:2 * (len(indices) // 2)])
-
-    # Create a color map: assign the same color to containers with the same length
-    unique_lengths = sorted(set(container_lengths))
-    cmap = plt.get_cmap('tab20', len(unique_lengths))
-    length_color_map = {length: cmap(i) for i, length in enumerate(unique_lengths)}
+    # Same color for containers with the same length, shared with the tandem truck plots
+    unique_lengths = tuple(np.unique(lengths).tolist())
+    length_color_map = color_map(unique_lengths)
 
     # Create a new figure for visualization
-    fig, ax = plt.subplots(figsize=(8, 6))
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
     ax.set_xlim(0, main_width)
     ax.set_ylim(0, main_length)
     ax.set_xlabel('Width (mm)')
@@ -201,43 +314,40 @@ def visualize_assignment(
     main_rect = patches.Rectangle((0, 0), main_width, main_length, linewidth=2, edgecolor='black', facecolor='none')
     ax.add_patch(main_rect)
 
+    rects = []
+    facecolors = []
+    edgecolors = []
+    linewidths = []
     for col in range(num_columns):
-        current_height = 0
-        for idx in columns[col]:
-            length = container_lengths[idx]
-            color = length_color_map[length]
-            rect = patches.Rectangle(
-                (col * container_width, current_height),
-                container_width,
-                length,
-                linewidth=1,
-                edgecolor='blue' if idx not in paired_indices else 'red',
-                facecolor=color,
-                alpha=0.6
-            )
+        # Containers stack from the bottom, so each one starts at the prefix sum of those below it
+        column_lengths = lengths[columns[col]]
+        bottoms = np.cumsum(column_lengths) - column_lengths
+        for idx, bottom, length in zip(columns[col], bottoms.tolist(), column_lengths.tolist()):
+            rects.append(patches.Rectangle((col * container_width, bottom), container_width, length))
+            facecolors.append(length_color_map[length])
             # Highlight paired containers with a thicker red edge
-            if idx in paired_indices:
-                rect.set_edgecolor('red')
-                rect.set_linewidth(2)
-            ax.add_patch(rect)
+            edgecolors.append('red' if idx in paired_indices else 'blue')
+            linewidths.append(2 if idx in paired_indices else 1)
             # Annotate the container with its index
             ax.text(
                 col * container_width + container_width / 2,
-                current_height + length / 2,
+                bottom + length / 2,
                 str(idx + 1),
                 ha='center',
                 va='center',
                 fontsize=8,
                 color='white'
             )
-            current_height += length
-
-    # Create a legend for container lengths
-    handles = [
-        patches.Patch(color=color, label=f'Length {length} mm')
-        for length, color in length_color_map.items()
-    ]
-    ax.legend(handles=handles, title='Container Lengths', bbox_to_anchor=(1.05, 1), loc='upper left')
+
+    ax.add_collection(PatchCollection(
+        rects,
+        facecolors=facecolors,
+        edgecolors=edgecolors,
+        linewidths=linewidths,
+        alpha=0.6
+    ))
+
+    ax.legend(handles=legend_handles(unique_lengths), title='Container Lengths', bbox_to_anchor=(1.05, 1), loc='upper left')
 
     # Set aspect ratio to equal to maintain scaling
     ax.set_aspect('equal', adjustable='box')